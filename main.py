@@ -1,206 +1,587 @@
 
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from fastapi.responses import JSONResponse
-import requests
-import json
-import hashlib
-from datetime import datetime
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response
+import httpx
+import orjson
+import redis.asyncio as redis
+from redis.exceptions import RedisError
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
 import asyncio
+import os
+import socket
+import sys
+import time
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from itertools import chain, islice
 import uvicorn
 
-app = FastAPI(title="BloxFruit Stock Monitor", version="1.0.0")
+# Log records are queued and formatted/written to stdout by a listener thread,
+# so the event loop never blocks on console I/O; pass arguments lazily (%-style)
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread"""
+    def prepare(self, record):
+        return record  # Same process, so the record needn't be pre-formatted for pickling
 
-# Global variables to store previous data hash and webhook URLs
-previous_data_hash = None
-monitoring_active = False
-webhook_urls = set()  # Use set to avoid duplicate webhooks
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+logger = logging.getLogger("bloxfruit")
+logger.setLevel(logging.INFO)
+logger.addHandler(DeferredQueueHandler(log_queue))
+logger.propagate = False
 
-def get_bloxfruit_data():
-    """Fetch data from the BloxFruit API"""
+# State shared by all uvicorn workers lives in Redis
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+WEBHOOKS_KEY = "bloxfruit:webhooks"  # SET of webhook URLs
+PREVIOUS_BODY_KEY = "bloxfruit:previous_data"
+LAST_DATA_KEY = "bloxfruit:last_data"
+MONITOR_CONFIG_KEY = "bloxfruit:monitor:config"  # "min:max" polling intervals, set when monitoring starts
+MONITOR_LOCK_KEY = "bloxfruit:monitor:lock"
+MONITOR_LOCK_GRACE = 5  # seconds the lock outlives the leader's sleep, for the Redis round trips after it
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # One monitor_task runs per worker
+
+# Compare-and-act on the monitor lock in one step, so a lock that expired and was
+# taken by another worker is never extended or deleted by its previous holder
+RENEW_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("EXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_LOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("DEL", KEYS[1])
+end
+return 0
+"""
+
+# Remove a webhook and, in the same step, stop monitoring when it was the last one.
+# The previous snapshot goes too, so a restart notifies with the full listing again.
+REMOVE_WEBHOOK_SCRIPT = """
+local removed = redis.call("SREM", KEYS[1], ARGV[1])
+local remaining = redis.call("SCARD", KEYS[1])
+if remaining == 0 then
+    redis.call("DEL", KEYS[2], KEYS[3])
+end
+return {removed, remaining}
+"""
+
+# Per-worker state
+monitor_wakeup = asyncio.Event()  # Set when this worker starts monitoring, so its monitor needn't wait
+last_seen_body = None  # Last upstream body this worker polled while holding the monitor lock
+upstream_validators = {}  # Conditional GET headers taken from that body's response
+
+NOT_MODIFIED = object()  # Returned by get_bloxfruit_response when the upstream answers 304
+webhook_meta = {}  # Webhook URL -> WebhookMeta, only used by the polling leader
+
+# Polling interval bounds (seconds); unchanged polls back off towards the max
+DEFAULT_MIN_INTERVAL = 30
+DEFAULT_MAX_INTERVAL = 300
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+URL_PREFIXES = ("https://discord.com/api/webhooks/", "https://discordapp.com/api/webhooks/")
+
+# A webhook that fails this many times in a row is skipped for the cooldown
+WEBHOOK_MAX_FAILURES = 3
+WEBHOOK_COOLDOWN = 60  # seconds
+
+@dataclass
+class WebhookMeta:
+    """Delivery state for a registered webhook"""
+    fail_count: int = 0
+    disabled_until: float = 0.0
+    last_success: float = 0.0
+
+# Stock types and the emoji used for their items
+STOCK_TYPES = {"normal_stock": "🍇", "mirage_stock": "⭐"}
+PRICE_KEYS = ("usd_price", "robux_price")
+
+# Discord rejects embeds with more fields than this, so extra items are never built
+MAX_EMBED_FIELDS = 25
+
+ICON_URL = "https://cdn.discordapp.com/emojis/123456789.png"
+
+# Static parts of each embed, merged with per-notification values via {**template, ...}.
+# The footer dicts are shared by every embed built from them and must not be mutated.
+STOCK_EMBEDS = {
+    "normal_stock": {
+        "title": "🔹 Normal Stock Update",
+        "color": 0x3498db,  # Blue color for normal stock
+        "footer": {"text": "BloxFruit Monitor • Normal Stock", "icon_url": ICON_URL}
+    },
+    "mirage_stock": {
+        "title": "✨ Mirage Stock Update",
+        "color": 0xe74c3c,  # Red color for mirage stock
+        "footer": {"text": "BloxFruit Monitor • Mirage Stock", "icon_url": ICON_URL}
+    }
+}
+STOCK_DESCRIPTIONS = {
+    "normal_stock": "📦 Có {} mặt hàng trong kho thường",
+    "mirage_stock": "🌟 Có {} mặt hàng hiếm trong kho đặc biệt"
+}
+CHANGES_EMBED = {
+    "title": "📊 Stock Changes",
+    "footer": {"text": "BloxFruit Monitor • Stock Changes", "icon_url": ICON_URL}
+}
+FALLBACK_EMBED = {
+    "title": "🍎 BloxFruit Stock Update",
+    "description": "🔄 Stock đã được cập nhật nhưng không có dữ liệu mới",
+    "color": 0x95a5a6,
+    "footer": {"text": "BloxFruit Monitor Bot", "icon_url": ICON_URL}
+}
+
+# Last successfully fetched stock body is served by /api/stock/current for this long
+STOCK_CACHE_TTL = 5  # seconds
+
+# Detected changes wait here so a burst of them goes out as one POST per webhook
+BATCH_WINDOW = 5  # seconds
+BATCH_MAX_SIZE = 10
+change_queue = asyncio.Queue()
+
+@asynccontextmanager
+async def lifespan(app):
+    """Start logging, connect to Redis, create the shared HTTP client (pooled connections) and start background tasks;
+    on exit stop the tasks, hand over the monitor lock, close the shared clients and flush logs"""
+    log_listener.start()
+    app.state.redis = redis.Redis.from_url(REDIS_URL)
+    app.state.http = httpx.AsyncClient(
+        http2=True,  # Multiplex webhook POSTs to discord.com over one connection
+        timeout=5.0,
+        limits=httpx.Limits(max_connections=64, max_keepalive_connections=64, keepalive_expiry=300.0)
+    )
+    app.state.flusher = asyncio.create_task(webhook_flusher())
+    
+    # Every worker runs a monitor; they wait until monitoring starts and only the lock holder polls
+    app.state.monitor = asyncio.create_task(monitor_task())
+    
+    yield
+    
+    app.state.monitor.cancel()
+    app.state.flusher.cancel()
+    await asyncio.gather(app.state.monitor, app.state.flusher, return_exceptions=True)
+    try:
+        await release_monitor_lock()  # Let another worker take over without waiting for the TTL
+    except RedisError as e:
+        logger.error("❌ Không thể trả monitor lock: %s", e)
+    await app.state.http.aclose()
+    await app.state.redis.aclose()
+    log_listener.stop()
+
+app = FastAPI(title="BloxFruit Stock Monitor", version="1.0.0", default_response_class=ORJSONResponse, lifespan=lifespan)
+
+async def get_bloxfruit_response(conditional=False):
+    """Fetch stock from the BloxFruit API, or NOT_MODIFIED for a conditional GET answered with 304"""
     try:
-        response = requests.get("http://test-hub.kys.gay/api/stock/bloxfruit")
+        response = await app.state.http.get(
+            "http://test-hub.kys.gay/api/stock/bloxfruit",
+            headers=upstream_validators if conditional else None
+        )
+        if conditional and response.status_code == 304:
+            return NOT_MODIFIED
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"❌ Error fetching BloxFruit data: {e}")
+    except httpx.HTTPError as e:
+        logger.error("❌ Error fetching BloxFruit data: %s", e)
         return None
+    
+    return response
 
-def get_data_hash(data):
-    """Generate hash of data to detect changes"""
-    if not data:
+def parse_stock_body(body):
+    """Decode an upstream body, or return None if it is not a JSON object (counts as a failed fetch)"""
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ Error fetching BloxFruit data: %s", e)
         return None
-    data_string = json.dumps(data, sort_keys=True)
-    return hashlib.md5(data_string.encode()).hexdigest()
-
-def has_data_changed(data):
-    """Check if data has changed since last check"""
-    global previous_data_hash
-    current_hash = get_data_hash(data)
     
-    if previous_data_hash is None:
-        previous_data_hash = current_hash
-        return True  # First run, consider as changed
+    if not isinstance(data, dict):
+        logger.error("❌ Error fetching BloxFruit data: expected a JSON object")
+        return None
     
-    if current_hash != previous_data_hash:
-        previous_data_hash = current_hash
+    return data
+
+def remember_validators(response):
+    """Keep the ETag / Last-Modified headers of an accepted response, if the upstream sends them, for the next conditional GET"""
+    upstream_validators.clear()
+    etag = response.headers.get("ETag")
+    if etag:
+        upstream_validators["If-None-Match"] = etag
+    last_modified = response.headers.get("Last-Modified")
+    if last_modified:
+        upstream_validators["If-Modified-Since"] = last_modified
+
+async def cache_stock_body(body):
+    """Remember the latest fetched stock body for every worker"""
+    await app.state.redis.set(LAST_DATA_KEY, body, ex=STOCK_CACHE_TTL)  # Already JSON, served as-is
+
+async def swap_previous_body(body):
+    """Atomically store body as the latest snapshot and return the previous one (None on first run)"""
+    return await app.state.redis.set(PREVIOUS_BODY_KEY, body, get=True)
+
+def decode_previous_data(previous_body):
+    """Decode a stored snapshot for the diff, or None to notify with the full listing"""
+    try:
+        return orjson.loads(previous_body) if previous_body else None
+    except orjson.JSONDecodeError:
+        return None  # Unreadable snapshot
+
+async def get_webhook_urls():
+    """Get all registered webhook URLs"""
+    return [url.decode() for url in await app.state.redis.smembers(WEBHOOKS_KEY)]
+
+async def acquire_monitor_lock(ttl):
+    """Become or stay the single worker that polls upstream"""
+    r = app.state.redis
+    if await r.set(MONITOR_LOCK_KEY, WORKER_ID, nx=True, ex=ttl):
         return True
-    
-    return False
+    return bool(await r.eval(RENEW_LOCK_SCRIPT, 1, MONITOR_LOCK_KEY, WORKER_ID, ttl))
 
-def send_discord_webhook(data, webhook_urls):
-    """Send data to multiple Discord webhooks with separate embeds for each stock type"""
-    if not data or not webhook_urls:
-        return False
-    
+async def release_monitor_lock():
+    """Give up the monitor lock if this worker holds it"""
+    await app.state.redis.eval(RELEASE_LOCK_SCRIPT, 1, MONITOR_LOCK_KEY, WORKER_ID)
+
+async def get_check_interval():
+    """Get the shared (min, max) polling intervals, or None if monitoring has not started"""
+    config = await app.state.redis.get(MONITOR_CONFIG_KEY)
+    if config is None:
+        return None
+    min_interval, max_interval = map(int, config.split(b":"))
+    return min_interval, max_interval
+
+async def start_monitoring(min_interval, max_interval):
+    """Start monitoring in every worker with the given intervals; returns False if it was already started"""
+    started = await app.state.redis.set(MONITOR_CONFIG_KEY, f"{min_interval}:{max_interval}", nx=True)
+    if started:
+        monitor_wakeup.set()
+    return bool(started)
+
+async def wait_for_monitoring(timeout):
+    """Sleep until this worker starts monitoring or the timeout passes"""
+    try:
+        await asyncio.wait_for(monitor_wakeup.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+
+def format_prices(item):
+    """Format an item's USD and Robux prices as an embed field value"""
+    return f"💰 **USD:** ${item.get('usd_price', 'N/A')}\n💎 **Robux:** {item.get('robux_price', 'N/A')}"
+
+def build_fields(items, emoji):
+    """Build embed fields for a list of stock items"""
+    return [
+        {
+            "name": f"{emoji} {item.get('name', 'Unknown')}",
+            "value": format_prices(item),
+            "inline": True
+        }
+        for item in islice(items, MAX_EMBED_FIELDS)
+    ]
+
+def build_stock_embeds(data, timestamp):
+    """Build full listing embeds for each stock type"""
     embeds = []
     
-    # Create embed for Normal Stock
-    if "normal_stock" in data and "items" in data["normal_stock"]:
-        normal_items = data["normal_stock"]["items"]
-        
-        normal_embed = {
-            "title": "🔹 Normal Stock Update",
-            "description": f"📦 Có {len(normal_items)} mặt hàng trong kho thường",
-            "color": 0x3498db,  # Blue color for normal stock
-            "timestamp": datetime.utcnow().isoformat(),
-            "footer": {
-                "text": "BloxFruit Monitor • Normal Stock",
-                "icon_url": "https://cdn.discordapp.com/emojis/123456789.png"
-            },
-            "fields": []
-        }
-        
-        for item in normal_items:
-            name = item.get("name", "Unknown")
-            usd_price = item.get("usd_price", "N/A")
-            robux_price = item.get("robux_price", "N/A")
-            
-            normal_embed["fields"].append({
-                "name": f"🍇 {name}",
-                "value": f"💰 **USD:** ${usd_price}\n💎 **Robux:** {robux_price}",
-                "inline": True
+    for stock_type, emoji in STOCK_TYPES.items():
+        if stock_type in data and "items" in data[stock_type]:
+            items = data[stock_type]["items"]
+            embeds.append({
+                **STOCK_EMBEDS[stock_type],
+                "description": STOCK_DESCRIPTIONS[stock_type].format(len(items)),
+                "timestamp": timestamp,
+                "fields": build_fields(items, emoji)
             })
-        
-        embeds.append(normal_embed)
     
-    # Create embed for Mirage Stock
-    if "mirage_stock" in data and "items" in data["mirage_stock"]:
-        mirage_items = data["mirage_stock"]["items"]
-        
-        mirage_embed = {
-            "title": "✨ Mirage Stock Update",
-            "description": f"🌟 Có {len(mirage_items)} mặt hàng hiếm trong kho đặc biệt",
-            "color": 0xe74c3c,  # Red color for mirage stock
-            "timestamp": datetime.utcnow().isoformat(),
-            "footer": {
-                "text": "BloxFruit Monitor • Mirage Stock",
-                "icon_url": "https://cdn.discordapp.com/emojis/123456789.png"
-            },
-            "fields": []
+    return embeds
+
+def get_stock_items(data):
+    """Map (stock type, item name) to item for every stock item"""
+    items = {}
+    for stock_type in STOCK_TYPES:
+        for item in data.get(stock_type, {}).get("items", []):
+            items[(stock_type, item.get("name", "Unknown"))] = item
+    return items
+
+def diff_items(old, new):
+    """Compare two stock snapshots by item name, returning (added, removed, price_changed)"""
+    old_items = get_stock_items(old)
+    new_items = get_stock_items(new)
+    
+    added = [(key[0], item) for key, item in new_items.items() if key not in old_items]
+    removed = [(key[0], item) for key, item in old_items.items() if key not in new_items]
+    price_changed = [
+        (key[0], old_items[key], item)
+        for key, item in new_items.items()
+        if key in old_items and any(item.get(price) != old_items[key].get(price) for price in PRICE_KEYS)
+    ]
+    return added, removed, price_changed
+
+def build_changes_embed(changes, timestamp):
+    """Build a single embed listing only added, removed and re-priced items"""
+    added, removed, price_changed = changes
+    if not (added or removed or price_changed):
+        return None
+    
+    added_fields = (
+        {
+            "name": f"🟢 {STOCK_TYPES[stock_type]} {item.get('name', 'Unknown')}",
+            "value": format_prices(item),
+            "inline": True
         }
-        
-        for item in mirage_items:
-            name = item.get("name", "Unknown")
-            usd_price = item.get("usd_price", "N/A")
-            robux_price = item.get("robux_price", "N/A")
-            
-            mirage_embed["fields"].append({
-                "name": f"⭐ {name}",
-                "value": f"💰 **USD:** ${usd_price}\n💎 **Robux:** {robux_price}",
-                "inline": True
-            })
-        
-        embeds.append(mirage_embed)
+        for stock_type, item in added
+    )
+    removed_fields = (
+        {
+            "name": f"🔴 {STOCK_TYPES[stock_type]} {item.get('name', 'Unknown')}",
+            "value": "❌ Đã hết hàng",
+            "inline": True
+        }
+        for stock_type, item in removed
+    )
+    price_fields = (
+        {
+            "name": f"🟡 {STOCK_TYPES[stock_type]} {new_item.get('name', 'Unknown')}",
+            "value": (
+                f"💰 **USD:** ${old_item.get('usd_price', 'N/A')} → ${new_item.get('usd_price', 'N/A')}\n"
+                f"💎 **Robux:** {old_item.get('robux_price', 'N/A')} → {new_item.get('robux_price', 'N/A')}"
+            ),
+            "inline": True
+        }
+        for stock_type, old_item, new_item in price_changed
+    )
+    # Generators, so only the fields that fit in the embed are built
+    fields = list(islice(chain(added_fields, removed_fields, price_fields), MAX_EMBED_FIELDS))
+    
+    # Green when items only arrived, red when they only left, yellow otherwise
+    if added and not (removed or price_changed):
+        color = 0x2ecc71
+    elif removed and not (added or price_changed):
+        color = 0xe74c3c
+    else:
+        color = 0xf1c40f
+    
+    return {
+        **CHANGES_EMBED,
+        "description": f"➕ {len(added)} mới • ➖ {len(removed)} hết hàng • 💱 {len(price_changed)} đổi giá",
+        "color": color,
+        "timestamp": timestamp,
+        "fields": fields
+    }
+
+def record_webhook_result(webhook_url, ok):
+    """Update a webhook's delivery state, disabling it after repeated failures"""
+    meta = webhook_meta.get(webhook_url)
+    if meta is None:
+        return  # Removed while the POST was in flight
+    
+    now = time.monotonic()
+    if ok:
+        meta.fail_count = 0
+        meta.last_success = now
+        return
+    
+    meta.fail_count += 1
+    if meta.fail_count >= WEBHOOK_MAX_FAILURES:
+        meta.disabled_until = now + WEBHOOK_COOLDOWN
+        logger.error("❌ Tạm dừng webhook %.50s... trong %d giây", webhook_url, WEBHOOK_COOLDOWN)
+
+async def post_webhook(webhook_url, body):
+    """POST a pre-serialized JSON body to a single Discord webhook"""
+    try:
+        response = await app.state.http.post(
+            webhook_url,
+            content=body,
+            headers=JSON_HEADERS
+        )
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.error("❌ Lỗi khi gửi webhook %.50s...: %s", webhook_url, e)
+        record_webhook_result(webhook_url, False)
+        return False
+    
+    logger.info("✅ Đã gửi thông báo đến webhook: %.50s...", webhook_url)
+    record_webhook_result(webhook_url, True)
+    return True
+
+async def send_discord_webhook(data, webhook_urls, previous_data=None):
+    """Send data to multiple Discord webhooks, listing only changes when previous data is known"""
+    # Forget delivery state for webhooks removed (on any worker) since the last notification
+    for url in webhook_meta.keys() - set(webhook_urls):
+        del webhook_meta[url]
+    
+    # Skip webhooks that are cooling down after repeated failures
+    now = time.monotonic()
+    targets = tuple(
+        url for url in webhook_urls
+        if webhook_meta.setdefault(url, WebhookMeta()).disabled_until <= now
+    )
+    
+    if not data or not targets:
+        return False
+    
+    timestamp = datetime.now(timezone.utc).isoformat()  # Shared by every embed
+    
+    if previous_data is None:
+        embeds = build_stock_embeds(data, timestamp)
+    else:
+        # Only send the items that changed since the last notification
+        changes_embed = build_changes_embed(diff_items(previous_data, data), timestamp)
+        embeds = [changes_embed] if changes_embed else []
     
     # If no stock data found, send a general update
     if not embeds:
-        embeds.append({
-            "title": "🍎 BloxFruit Stock Update",
-            "description": "🔄 Stock đã được cập nhật nhưng không có dữ liệu mới",
-            "color": 0x95a5a6,
-            "timestamp": datetime.utcnow().isoformat(),
-            "footer": {
-                "text": "BloxFruit Monitor Bot",
-                "icon_url": "https://cdn.discordapp.com/emojis/123456789.png"
-            }
-        })
+        embeds.append({**FALLBACK_EMBED, "timestamp": timestamp})
     
     # Prepare webhook payload
     payload = {
         "username": "BloxFruit Monitor",
-        "avatar_url": "https://cdn.discordapp.com/emojis/123456789.png",
+        "avatar_url": ICON_URL,
         "embeds": embeds
     }
     
-    success_count = 0
-    total_webhooks = len(webhook_urls)
+    body = orjson.dumps(payload)  # Serialize once for every webhook
+    total_webhooks = len(targets)
+    results = await asyncio.gather(
+        *(post_webhook(webhook_url, body) for webhook_url in targets),
+        return_exceptions=True
+    )
+    success_count = sum(1 for result in results if result is True)
     
-    for webhook_url in webhook_urls:
-        try:
-            response = requests.post(
-                webhook_url,
-                json=payload,
-                headers={"Content-Type": "application/json"}
-            )
-            response.raise_for_status()
-            success_count += 1
-            print(f"✅ Đã gửi thông báo đến webhook: {webhook_url[:50]}...")
-        except requests.exceptions.RequestException as e:
-            print(f"❌ Lỗi khi gửi webhook {webhook_url[:50]}...: {e}")
-    
-    print(f"📊 Gửi thành công {success_count}/{total_webhooks} webhooks")
+    logger.info("📊 Gửi thành công %d/%d webhooks", success_count, total_webhooks)
     return success_count > 0
 
+async def webhook_flusher():
+    """Background task that merges queued changes into one notification per batch window"""
+    loop = asyncio.get_running_loop()
+    
+    while True:
+        batch = [await change_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW
+        
+        while len(batch) < BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(change_queue.get(), timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        # Diff from the oldest snapshot to the newest covers every change in the batch
+        old_data, _ = batch[0]
+        _, data = batch[-1]
+        
+        try:
+            success = await send_discord_webhook(data, await get_webhook_urls(), old_data)
+        except Exception as e:
+            logger.error("❌ Lỗi khi gửi thông báo: %s", e)
+            continue
+        
+        if success:
+            logger.info("🎉 Đã thông báo %d thay đổi thành công!", len(batch))
+        else:
+            logger.error("❌ Không thể gửi thông báo")
+
 async def monitor_task():
-    """Background task to monitor BloxFruit stock"""
-    global monitoring_active, webhook_urls
-    monitoring_active = True
+    """Background task run by every worker; only the worker holding the monitor lock polls upstream"""
+    global last_seen_body
     check_count = 0
+    is_leader = False
+    min_interval = DEFAULT_MIN_INTERVAL
+    interval = min_interval
     
-    print("🚀 Bắt đầu theo dõi BloxFruit stock...")
-    print("⏱️  Bot sẽ kiểm tra thay đổi mỗi 30 giây")
-    
-    try:
-        while monitoring_active:
+    while True:
+        try:
+            intervals = await get_check_interval()
+            if intervals is None:
+                is_leader = False
+                monitor_wakeup.clear()
+                await wait_for_monitoring(DEFAULT_MIN_INTERVAL)  # No webhook registered
+                continue
+            min_interval, max_interval = intervals
+            
+            # Held across this poll; renewed for the sleep once the poll is done
+            if not await acquire_monitor_lock(max_interval + MONITOR_LOCK_GRACE):
+                is_leader = False
+                await asyncio.sleep(min_interval)  # Another worker is polling
+                continue
+            
+            if not is_leader:
+                is_leader = True
+                interval = min_interval
+                # Another leader may have moved the shared state on since this worker last polled
+                last_seen_body = None
+                upstream_validators.clear()
+                logger.info("🚀 Bắt đầu theo dõi BloxFruit stock...")
+                logger.info("⏱️  Bot sẽ kiểm tra thay đổi mỗi %d-%d giây", min_interval, max_interval)
+            
             check_count += 1
             current_time = datetime.now().strftime("%H:%M:%S")
             
-            print(f"📡 [{current_time}] Kiểm tra lần #{check_count}...")
+            logger.info("📡 [%s] Kiểm tra lần #%d...", current_time, check_count)
             
-            # Fetch data from API
-            data = get_bloxfruit_data()
+            # Fetch data from API, conditional on the last body this worker saw
+            response = await get_bloxfruit_response(conditional=True)
             
-            if data:
-                # Check if data has changed
-                if has_data_changed(data):
-                    print("🔄 Phát hiện thay đổi trong stock!")
-                    
-                    # Send webhook notification to all registered webhooks
-                    success = send_discord_webhook(data, webhook_urls)
+            if response is NOT_MODIFIED:
+                logger.info("✅ Không có thay đổi (304), tiếp tục theo dõi...")
+                interval = min(interval * 2, max_interval)  # Back off while quiet
+                if last_seen_body:
+                    await cache_stock_body(last_seen_body)
+            elif response and response.content == last_seen_body:
+                # Fast path: bytes equality compares lengths before a memcmp, and this body
+                # was already validated, so only the cache is refreshed (no decode or swap)
+                logger.info("✅ Không có thay đổi, tiếp tục theo dõi...")
+                interval = min(interval * 2, max_interval)  # Back off while quiet
+                await cache_stock_body(last_seen_body)
+                remember_validators(response)
+            elif response and (data := parse_stock_body(response.content)) is not None:
+                # A new body is decoded and validated before anything is stored
+                body = response.content
+                await cache_stock_body(body)
+                
+                # One atomic swap both detects the change and keeps the old snapshot for the diff
+                previous_body = await swap_previous_body(body)
+                last_seen_body = body
+                if previous_body != body:
+                    logger.info("🔄 Phát hiện thay đổi trong stock!")
+                    interval = min_interval
                     
-                    if success:
-                        print("🎉 Đã thông báo thay đổi thành công!")
-                    else:
-                        print("❌ Không thể gửi thông báo")
+                    # Queue the change; webhook_flusher notifies all registered webhooks
+                    change_queue.put_nowait((decode_previous_data(previous_body), data))
                 else:
-                    print("✅ Không có thay đổi, tiếp tục theo dõi...")
+                    logger.info("✅ Không có thay đổi, tiếp tục theo dõi...")
+                    interval = min(interval * 2, max_interval)  # Back off while quiet
+                
+                # Only an accepted body may answer later polls with 304
+                remember_validators(response)
             else:
-                print("❌ Không thể lấy dữ liệu từ API")
+                logger.error("❌ Không thể lấy dữ liệu từ API")
+                interval = min_interval
             
-            await asyncio.sleep(30)  # Wait 30 seconds before next check
+            # Renew after the fetch, so a slow upstream can't eat into the time the lock covers
+            if not await acquire_monitor_lock(interval + MONITOR_LOCK_GRACE):
+                is_leader = False  # Lost it mid-poll; re-contend (and reset) next round
             
-    except Exception as e:
-        print(f"❌ Lỗi trong quá trình monitor: {e}")
-        monitoring_active = False
+            await asyncio.sleep(interval)  # Wait before next check
+            
+        except Exception as e:
+            # Keep monitoring through transient errors (e.g. Redis briefly unreachable)
+            logger.error("❌ Lỗi trong quá trình monitor: %s", e)
+            is_leader = False
+            await asyncio.sleep(min_interval)
 
 @app.get("/")
 async def root():
     """Root endpoint"""
+    monitoring_active = await get_check_interval() is not None
     return {
         "message": "🤖 BloxFruit Stock Monitor API",
         "status": "active" if monitoring_active else "inactive",
         "endpoints": {
-            "/api/stock/blox-fruit?webhook=": "Add webhook and start monitoring",
+            "/api/stock/blox-fruit?webhook=&min_interval=&max_interval=": "Add webhook and start monitoring",
             "/api/webhooks": "Get all registered webhooks",
             "/api/webhooks/remove?webhook=": "Remove a webhook",
             "/status": "Check monitoring status",
@@ -209,84 +590,94 @@ async def root():
     }
 
 @app.get("/api/stock/blox-fruit")
-async def add_webhook_and_start_monitoring(webhook: str, background_tasks: BackgroundTasks):
+async def add_webhook_and_start_monitoring(
+    webhook: str,
+    min_interval: int = DEFAULT_MIN_INTERVAL,
+    max_interval: int = DEFAULT_MAX_INTERVAL
+):
     """Add webhook URL and start monitoring BloxFruit stock"""
-    global monitoring_active, webhook_urls
-    
     if not webhook:
         raise HTTPException(status_code=400, detail="Webhook URL is required")
     
     # Validate webhook URL
-    if not webhook.startswith("https://discord.com/api/webhooks/"):
+    if not webhook.startswith(URL_PREFIXES):
         raise HTTPException(status_code=400, detail="Invalid Discord webhook URL")
     
-    # Add webhook to the set
-    webhook_urls.add(webhook)
+    if min_interval < 1 or max_interval < min_interval:
+        raise HTTPException(status_code=400, detail="Invalid polling interval")
     
-    # Start monitoring if not already active
-    if not monitoring_active:
-        background_tasks.add_task(monitor_task)
+    # Add webhook to the shared set
+    await app.state.redis.sadd(WEBHOOKS_KEY, webhook)
+    
+    # Start monitoring if not already active; the intervals only apply when it starts
+    if await start_monitoring(min_interval, max_interval):
         message = "🚀 BloxFruit stock monitoring started!"
     else:
         message = "✅ Webhook added to existing monitoring"
+    intervals = await get_check_interval()
     
-    return JSONResponse(
-        status_code=200,
-        content={
-            "message": message,
-            "webhook_added": webhook,
-            "total_webhooks": len(webhook_urls),
-            "check_interval": "30 seconds"
-        }
-    )
+    return {
+        "message": message,
+        "webhook_added": webhook,
+        "total_webhooks": await app.state.redis.scard(WEBHOOKS_KEY),
+        "check_interval": f"{intervals[0]}-{intervals[1]} seconds"
+    }
 
 @app.get("/status")
 async def get_status():
     """Get current monitoring status"""
+    monitoring_active = await get_check_interval() is not None
     return {
         "monitoring_active": monitoring_active,
-        "total_webhooks": len(webhook_urls),
+        "total_webhooks": await app.state.redis.scard(WEBHOOKS_KEY),
         "message": "Monitoring is active" if monitoring_active else "Monitoring is not active"
     }
     
 @app.get("/api/stock/current")
 async def get_current_stock():
     """Get current BloxFruit stock data"""
-    data = get_bloxfruit_data()
-    if data:
-        return data
+    last_data_bytes = await app.state.redis.get(LAST_DATA_KEY)
+    if last_data_bytes:
+        return Response(content=last_data_bytes, media_type="application/json")
+    
+    response = await get_bloxfruit_response()
+    if response and parse_stock_body(response.content) is not None:
+        body = response.content
+        await cache_stock_body(body)
+        return Response(content=body, media_type="application/json")
     else:
         raise HTTPException(status_code=503, detail="Unable to fetch stock data")
 
 @app.get("/api/webhooks")
 async def get_webhooks():
     """Get all registered webhook URLs"""
+    webhook_urls = await get_webhook_urls()
     return {
-        "webhooks": list(webhook_urls),
+        "webhooks": webhook_urls,
         "total_count": len(webhook_urls),
-        "monitoring_active": monitoring_active
+        "monitoring_active": await get_check_interval() is not None
     }
 
 @app.get("/api/webhooks/remove")
 async def remove_webhook(webhook: str):
     """Remove a webhook URL from monitoring"""
-    global webhook_urls
-    
     if not webhook:
         raise HTTPException(status_code=400, detail="Webhook URL is required")
     
-    if webhook in webhook_urls:
-        webhook_urls.remove(webhook)
-        return JSONResponse(
-            status_code=200,
-            content={
-                "message": "✅ Webhook removed successfully",
-                "webhook_removed": webhook,
-                "remaining_webhooks": len(webhook_urls)
-            }
-        )
+    removed, remaining = await app.state.redis.eval(
+        REMOVE_WEBHOOK_SCRIPT, 3, WEBHOOKS_KEY, MONITOR_CONFIG_KEY, PREVIOUS_BODY_KEY, webhook
+    )
+    webhook_meta.pop(webhook, None)
+    
+    if removed:
+        return {
+            "message": "✅ Webhook removed successfully",
+            "webhook_removed": webhook,
+            "remaining_webhooks": remaining
+        }
     else:
         raise HTTPException(status_code=404, detail="Webhook not found")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    # Workers share state through Redis, so the app is passed as an import string
+    uvicorn.run("main:app", host="0.0.0.0", port=5000, loop="uvloop", http="httptools", workers=os.cpu_count() or 1)